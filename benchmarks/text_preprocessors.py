@@ -0,0 +1,174 @@
+"""Benchmarks for psy.utilities.text_preprocessors on seeded synthetic corpora.
+
+Reports strings/s, MB/s and peak memory for every public function in the module and saves them as JSON.
+Usage:
+python benchmarks/text_preprocessors.py --output bench.json
+python benchmarks/text_preprocessors.py --functions text_cleaner --compare bench.json
+"""
+import argparse
+import inspect
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from psy.utilities import helpers
+from psy.utilities import text_preprocessors as tp
+
+WORDS = ['revenue', 'operations', 'total', 'income', 'expenses', 'profit', 'loss', 'deferred', 'tax', 'cash',
+         'equivalents', 'trade', 'receivables', 'note', 'other', 'net', 'of', 'the', 'for', 'year', 'in', 'at',
+         'January', 'March', 'Sep', 'December', 'ii', 'iv', 'XII', 'mix']
+NON_ASCII = 'éèêàâçñüößæøåœ€£°½“”—…ёжд中文'
+MARKERS = ['(a)', '(b)', '(ii)', '(iv)', '(1)', '1.', '{a}', '(c}', '()']
+
+# Corpora vary length, share of non-ASCII characters, digit density and bracket density
+CORPORA = {
+    'short': dict(words=(2, 8), non_ascii=0.0, digits=0.05, brackets=0.05),
+    'long': dict(words=(100, 300), non_ascii=0.0, digits=0.05, brackets=0.05),
+    'non_ascii': dict(words=(5, 30), non_ascii=0.3, digits=0.05, brackets=0.05),
+    'digits': dict(words=(5, 30), non_ascii=0.0, digits=0.4, brackets=0.05),
+    'brackets': dict(words=(5, 30), non_ascii=0.0, digits=0.05, brackets=0.4),
+}
+
+SKIP = {'get_html_parser'}
+KWARGS = {'truncate_text': {'max_len': 50}}
+
+
+def make_corpus(n_strings, words=(5, 30), non_ascii=0.0, digits=0.0, brackets=0.0, seed=0):
+    """Seeded list of n_strings synthetic table/statement lines."""
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(n_strings):
+        tokens = []
+        for _ in range(rng.randint(*words)):
+            token = rng.choice(WORDS)
+            if rng.random() < non_ascii:
+                pos = rng.randrange(len(token))
+                token = token[:pos] + rng.choice(NON_ASCII) + token[pos + 1:]
+            if rng.random() < digits:
+                token = rng.choice(['%d' % rng.randint(0, 99999), '%d,%03d' % (rng.randint(1, 999), rng.randint(0, 999)),
+                                    token + str(rng.randint(0, 9))])
+            if rng.random() < brackets:
+                token = rng.choice(MARKERS) if rng.random() < 0.5 else '(%s)' % token
+            tokens.append(token)
+        line = ' '.join(tokens)
+        if rng.random() < 0.1:
+            line = line.replace(' ', '\n', 1)
+        corpus.append(line)
+    return corpus
+
+
+def _write_html_files(corpus, directory):
+    for i, text in enumerate(corpus):
+        with open(os.path.join(directory, '%d.html' % i), 'w', encoding='utf-8') as f:
+            f.write('<html><body><p>%s</p></body></html>' % text)
+
+
+def get_runners(corpus, html_directory):
+    """Callables running one function over the whole corpus, keyed by function name."""
+    runners = {}
+    for name, func in inspect.getmembers(tp, inspect.isfunction):
+        if name.startswith('_') or name in SKIP or func.__module__ != tp.__name__:
+            continue
+        kwargs = KWARGS.get(name, {})
+        if name.endswith('_batch'):
+            runners[name] = lambda func=func, kwargs=kwargs: func(corpus, **kwargs)
+        elif name == 'clean_texts_parallel':
+            runners[name] = lambda func=func: list(func(corpus))
+        elif name == 'get_text_from_html_files':
+            runners[name] = lambda func=func: list(func(html_directory))
+        elif name == 'get_text_from_html_file':
+            paths = [os.path.join(html_directory, '%d.html' % i) for i in range(len(corpus))]
+            runners[name] = lambda func=func: [func(p) for p in paths]
+        else:
+            runners[name] = lambda func=func, kwargs=kwargs: [func(x, **kwargs) for x in corpus]
+    runners['text_cleaner[fused]'] = lambda: [tp.text_cleaner(x, method='fused') for x in corpus]
+    runners['text_cleaner_batch[fused]'] = lambda: tp.text_cleaner_batch(corpus, method='fused')
+    # Batch functions on a Series against the per row Series.apply they replace
+    series = pd.Series(corpus)
+    runners['text_cleaner[Series.apply]'] = lambda: series.apply(tp.text_cleaner)
+    runners['text_cleaner_batch[Series]'] = lambda: tp.text_cleaner_batch(series)
+    runners['text_cleaner_batch[Series,fused]'] = lambda: tp.text_cleaner_batch(series, method='fused')
+    return runners
+
+
+def measure(runner, repeat=3):
+    """Best wall time of repeat runs and peak traced memory of one extra run."""
+    seconds = min(_time(runner) for _ in range(repeat))
+    tracemalloc.start()
+    runner()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, peak
+
+
+def _time(runner):
+    start = time.perf_counter()
+    runner()
+    return time.perf_counter() - start
+
+
+def run(n_strings=10000, repeat=3, seed=0, functions=None, corpora=None):
+    results = []
+    for corpus_name, params in CORPORA.items():
+        if corpora and corpus_name not in corpora:
+            continue
+        corpus = make_corpus(n_strings, seed=seed, **params)
+        mb = sum(len(x.encode('utf-8')) for x in corpus) / 1e6
+        with tempfile.TemporaryDirectory() as html_directory:
+            _write_html_files(corpus, html_directory)
+            for name, runner in sorted(get_runners(corpus, html_directory).items()):
+                if functions and name.split('[')[0] not in functions:
+                    continue
+                seconds, peak = measure(runner, repeat=repeat)
+                result = {'function': name, 'corpus': corpus_name, 'n_strings': n_strings, 'mb': mb,
+                          'seconds': seconds, 'strings_per_sec': n_strings / seconds, 'mb_per_sec': mb / seconds,
+                          'peak_memory_mb': peak / 1e6}
+                print('%-40s %-10s %12.0f strings/s %8.2f MB/s %8.2f MB peak' % (
+                    name, corpus_name, result['strings_per_sec'], result['mb_per_sec'], result['peak_memory_mb']))
+                results.append(result)
+    return {'meta': {'python': platform.python_version(), 'platform': platform.platform(),
+                     'cpu_count': helpers.get_cpu_count(), 'seed': seed, 'repeat': repeat,
+                     'timestamp': helpers.get_timestamp()},
+            'results': results}
+
+
+def compare(report, baseline):
+    """Prints the throughput ratio of report vs a baseline report for every function/corpus both contain."""
+    old = {(r['function'], r['corpus']): r for r in baseline['results']}
+    for r in report['results']:
+        key = (r['function'], r['corpus'])
+        if key in old:
+            print('%-40s %-10s %6.2fx' % (key + (r['strings_per_sec'] / old[key]['strings_per_sec'],)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--n-strings', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--functions', nargs='*', help='Function names to run, all by default')
+    parser.add_argument('--corpora', nargs='*', choices=sorted(CORPORA), help='Corpora to run, all by default')
+    parser.add_argument('--output', help='JSON file to save results to')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare throughput against')
+    args = parser.parse_args()
+
+    report = run(n_strings=args.n_strings, repeat=args.repeat, seed=args.seed,
+                 functions=args.functions, corpora=args.corpora)
+    if args.output:
+        helpers.save_json(report, args.output)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
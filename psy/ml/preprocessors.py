@@ -1,3 +1,4 @@
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 from os.path import join as joinpath
 
 import numpy as np
@@ -55,60 +56,210 @@ def flag_by_value_count(df, col_name, freq_threshold=2, drop=False, replace_by='
     return df
 
 
+NORMALIZER_STATS = ('maxv', 'minv', 'meanv', 'sdv')
+
+
+def _group_stats(df, scale_cols, groupby):
+    """Groups and the count, mean, sum of squared deviations (m2), min, max and NaN count per group of a chunk."""
+    grouped = df.groupby(groupby, sort=False)[scale_cols]
+    count = grouped.count()
+    # Corrected two-pass sum of squares, which unlike a one-pass variance stays accurate for values with a large offset
+    deviations = df[scale_cols] - grouped.transform('mean')
+    m2 = (deviations ** 2).groupby(df[groupby], sort=False).sum() - \
+        deviations.groupby(df[groupby], sort=False).sum() ** 2 / count
+    state = {'count': count.to_numpy(dtype=float),
+             'mean': grouped.mean().to_numpy(dtype=float),
+             'm2': m2.to_numpy(dtype=float),
+             'minv': grouped.min().to_numpy(dtype=float),
+             'maxv': grouped.max().to_numpy(dtype=float),
+             'nan_count': grouped.size().to_numpy(dtype=float)[:, None] - count.to_numpy(dtype=float)}
+    empty = state['count'] == 0
+    state['mean'] = np.where(empty, 0, state['mean'])
+    state['m2'] = np.where(empty, 0, state['m2'])
+    return count.index, state
+
+
+def _merge_group_stats(groups_a, a, groups_b, b):
+    """Combines two group states with Chan et al.'s parallel update of mean and m2, in any order."""
+    groups = groups_a.append(groups_b[~groups_b.isin(groups_a)])
+    index_a, index_b = groups.get_indexer(groups_a), groups.get_indexer(groups_b)
+    n_cols = a['count'].shape[1]
+
+    def expand(state, index):
+        full = {stat: np.zeros((len(groups), n_cols)) for stat in ('count', 'mean', 'm2', 'nan_count')}
+        full['minv'], full['maxv'] = np.full((len(groups), n_cols), np.nan), np.full((len(groups), n_cols), np.nan)
+        for stat, values in state.items():
+            full[stat][index] = values
+        return full
+
+    a, b = expand(a, index_a), expand(b, index_b)
+    count = a['count'] + b['count']
+    delta = b['mean'] - a['mean']
+    with np.errstate(invalid='ignore', divide='ignore'):
+        weight = np.where(count > 0, b['count'] / count, 0)
+    return groups, {'count': count,
+                    'mean': a['mean'] + delta * weight,
+                    'm2': a['m2'] + b['m2'] + delta ** 2 * a['count'] * weight,
+                    'minv': np.fmin(a['minv'], b['minv']),
+                    'maxv': np.fmax(a['maxv'], b['maxv']),
+                    'nan_count': a['nan_count'] + b['nan_count']}
+
+
+class GroupNormalizer(object):
+    """Normalizes scale_cols to zero mean and unit standard deviation within each group of the groupby column.
+
+    Statistics of all groups are computed in one groupby pass and kept as (n_groups, n_cols) arrays, so transform is a
+    single vectorised lookup. Columns that are constant or have no standard deviation in a group, and groups not seen
+    in fit, become NaN. Data that does not fit in memory can be fitted chunk by chunk with partial_fit or fit_chunks,
+    and normalizers fitted on different rows combined with merge.
+    Usage:
+    normalizer = GroupNormalizer(['price', 'volume'], 'ticker').fit(df_train)
+    normalizer.save('data/normalizer.json')
+    df_test = GroupNormalizer.load('data/normalizer.json').transform(df_test)
+    """
+
+    def __init__(self, scale_cols, groupby, should_skipna=True):
+        self.scale_cols = list(scale_cols)
+        self.groupby = groupby
+        self.should_skipna = should_skipna
+        self.groups = None  # pd.Index of the fitted groups, None if the same parameters apply to every group
+        self.params = None  # {stat: float array of shape (n_groups, n_cols)}
+        self._state_groups = self._state = None  # Mergeable count/mean/m2/min/max per group, see partial_fit
+
+    def fit(self, df):
+        self._state = None
+        self.partial_fit(df)
+        self._report_invalid()
+        return self
+
+    def partial_fit(self, df):
+        """Updates the statistics with a chunk of rows, ex. from pd.read_csv(chunksize=...) or a parquet row group.
+        Gives the same parameters as fit on all the chunks at once, up to floating point error."""
+        self._add_state(*_group_stats(df, self.scale_cols, self.groupby))
+        return self
+
+    def merge(self, other):
+        """Adds the statistics of another GroupNormalizer fitted on different rows, ex. in another process."""
+        assert (self.scale_cols, self.groupby) == (other.scale_cols, other.groupby), 'Normalizers do not match'
+        if other._state is not None:
+            self._add_state(other._state_groups, other._state)
+        return self
+
+    def fit_chunks(self, chunks, n_jobs=1):
+        """Fits on an iterable of DataFrames without holding them in memory together.
+        n_jobs > 1 computes the statistics of chunks in worker processes, keeping at most 2 * n_jobs chunks queued.
+        Usage:
+        normalizer.fit_chunks(pd.read_csv('features.csv', chunksize=10 ** 6), n_jobs=8)
+        """
+        self._state = None
+        if n_jobs == 1:
+            for chunk in chunks:
+                self.partial_fit(chunk)
+        else:
+            with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+                pending = set()
+                for chunk in chunks:
+                    if len(pending) >= 2 * n_jobs:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            self._add_state(*future.result())
+                    pending.add(executor.submit(_group_stats, chunk, self.scale_cols, self.groupby))
+                for future in pending:
+                    self._add_state(*future.result())
+        self._report_invalid()
+        return self
+
+    def _add_state(self, groups, state):
+        if self._state is not None:
+            groups, state = _merge_group_stats(self._state_groups, self._state, groups, state)
+        self._set_state(groups, state)
+
+    def _set_state(self, groups, state):
+        """Keeps the mergeable state and derives the parameters used by transform from it."""
+        self._state_groups, self._state = groups, state
+        count = state['count']
+        with np.errstate(invalid='ignore', divide='ignore'):
+            sdv = np.sqrt(np.maximum(state['m2'], 0) / (count - 1))
+        self.groups = groups
+        self.params = {'maxv': np.array(state['maxv']), 'minv': np.array(state['minv']),
+                       'meanv': np.where(count > 0, state['mean'], np.nan), 'sdv': np.where(count > 1, sdv, np.nan)}
+        if not self.should_skipna:
+            has_nan = state['nan_count'] > 0
+            for values in self.params.values():
+                values[has_nan] = np.nan
+
+    def _report_invalid(self):
+        invalid = ~self._is_valid()
+        if invalid.any():
+            print('%d of %d group/column pairs are constant or have no standard deviation and will be NaN'
+                  % (invalid.sum(), invalid.size))
+
+    def _is_valid(self):
+        maxv, minv, sdv = self.params['maxv'], self.params['minv'], self.params['sdv']
+        return (maxv != minv) & (sdv != 0) & ~np.isnan(sdv)
+
+    def transform(self, df):
+        """Returns df with the columns that are not scaled first, then the scaled columns."""
+        assert self.params is not None, 'GroupNormalizer is not fitted'
+        valid = self._is_valid()
+        # An extra NaN row for groups not seen in fit, which get_indexer returns as -1
+        meanv = np.vstack([np.where(valid, self.params['meanv'], np.nan), np.full(len(self.scale_cols), np.nan)])
+        sdv = np.vstack([self.params['sdv'], np.ones(len(self.scale_cols))])
+        if self.groups is None:
+            codes = np.zeros(len(df), dtype=int)
+        else:
+            codes = self.groups.get_indexer(df[self.groupby])
+        scaled = (df[self.scale_cols].to_numpy(dtype=float) - meanv[codes]) / sdv[codes]
+        non_scale_cols = [col for col in df.columns if col not in self.scale_cols]
+        return pd.concat([df[non_scale_cols], pd.DataFrame(scaled, index=df.index, columns=self.scale_cols)], axis=1)
+
+    def fit_transform(self, df):
+        return self.fit(df).transform(df)
+
+    def save(self, path):
+        """Saves the parameters column-wise, one array per statistic, as compact JSON."""
+        helpers.save_json({'groupby': self.groupby, 'scale_cols': self.scale_cols, 'should_skipna': self.should_skipna,
+                           'groups': None if self.groups is None else self.groups.tolist(),
+                           'params': {stat: values.tolist() for stat, values in self.params.items()}},
+                          path, compact=True)
+
+    @classmethod
+    def load(cls, path, groupby=None):
+        """Loads a saved GroupNormalizer. The {col: {stat: value}} files written by earlier versions of
+        normalize_inputs_groupwise are loaded with those parameters applied to every group."""
+        data = helpers.load_json(path)
+        if 'params' not in data:
+            normalizer = cls(list(data), groupby)
+            normalizer.params = {stat: np.array([[data[col][stat] for col in normalizer.scale_cols]], dtype=float)
+                                 for stat in NORMALIZER_STATS}
+            return normalizer
+        normalizer = cls(data['scale_cols'], data['groupby'], should_skipna=data['should_skipna'])
+        normalizer.groups = None if data['groups'] is None else pd.Index(data['groups'])
+        normalizer.params = {stat: np.array(values, dtype=float).reshape(-1, len(normalizer.scale_cols))
+                             for stat, values in data['params'].items()}
+        return normalizer
+
+
 def normalize_inputs_groupwise(df, scale_cols, groupby, save_dir='data', filename='normalizer.json', should_skipna=True, mode='train', save_dict=True):
-    """Takes a dataframe and normalizes scale_cols columns groupwise.
+    """Takes a dataframe and normalizes scale_cols columns groupwise, see GroupNormalizer.
     mode:
-    train - saves normalizer dictionary
-    predict - loads normalizer dictionary
+    train - saves normalizer
+    predict - loads normalizer
     """
     dict_path = joinpath(save_dir, filename)
     helpers.create_folder(save_dir, delete_old=False)
 
-    non_scale_cols = [col for col in df.columns if col not in scale_cols]
-    df_scale_cols = df[scale_cols]
-    groups = set(df[groupby])
-
-    for group in groups:
-        if mode == 'train':
-            normalizer = helpers.get_nested_defaultdict()
-        elif mode == 'predict':
-            normalizer = helpers.load_json(dict_path)
-
-        df_group = df_scale_cols[getattr(df, groupby) == group]
-        for c in scale_cols:
-            print(c)
-            df_group_col = df_group[c]
-            if mode == 'train':
-                maxv = df_group_col.max(axis=0, skipna=should_skipna)
-                minv = df_group_col.min(axis=0, skipna=should_skipna)
-                meanv = df_group_col.mean(axis=0, skipna=should_skipna)
-                sdv = df_group_col.std(axis=0, skipna=should_skipna)
-                # Filling dictionary
-                normalizer[c]['maxv'] = float(maxv)
-                normalizer[c]['minv'] = float(minv)
-                normalizer[c]['meanv'] = float(meanv)
-                normalizer[c]['sdv'] = float(sdv)
-            elif mode == 'predict':
-                # Loading values from dictionary
-                maxv = normalizer[c]['maxv']
-                minv = normalizer[c]['minv']
-                meanv = normalizer[c]['meanv']
-                sdv = normalizer[c]['sdv']
-            if maxv != minv and sdv != 0 and not np.isnan(sdv):
-                df_group[c] = (df_group_col - meanv) / sdv
-            else:
-                logger.warning('Problem col:%s for %s:%s' % (c, groupby, group))
-                df_group[c] = np.nan  # np.nan is actually None
-
-        if mode == 'train' and save_dict:
-            # Saving dictionary
-            helpers.save_json(normalizer, dict_path)
-
-        df_scale_cols.loc[getattr(df, groupby) == group] = df_group
+    if mode == 'train':
+        normalizer = GroupNormalizer(scale_cols, groupby, should_skipna=should_skipna).fit(df)
+        if save_dict:
+            normalizer.save(dict_path)
+    elif mode == 'predict':
+        normalizer = GroupNormalizer.load(dict_path, groupby=groupby)
 
+    df = normalizer.transform(df)
     print('Scaling complete.')
 
-    return pd.concat([df[non_scale_cols], df_scale_cols], axis=1)
+    return df
 
 
 def smooth_labels(y, smooth_factor=0.1):
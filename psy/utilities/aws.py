@@ -1,50 +1,196 @@
+import hashlib
+import io
+import json
 import os
+import queue
 import re
+import shutil
 import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import boto3
+import pandas as pd
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError
 
+MB = 1024 ** 2
 
-def set_parameter_value_kms(parameter_name, value):
-    os.system('aws ssm put-parameter --name %s --value %s --type SecureString --overwrite' % (
-        parameter_name, value))
+# Process-wide pool of boto3 sessions/clients. Creating them resolves credentials and endpoints, which costs
+# tens of milliseconds, so they are built once per (profile, region, service, endpoint) and shared.
+_pool_lock = threading.Lock()
+_sessions = {}
+_clients = {}
+_resources = threading.local()  # boto3 resources aren't thread-safe, so they are pooled per thread
+_endpoint_urls = {}
 
 
-def get_parameter_value_kms(parameter_name, region, profile=None):
+def reset_pool():
+    """Drops all pooled sessions, clients and resources. Called automatically in a child process after fork.
+    Call it after boto3.setup_default_session for clients already pooled to pick up the new default session."""
+    global _pool_lock, _resources
+    _pool_lock = threading.Lock()
+    _sessions.clear()
+    _clients.clear()
+    _resources = threading.local()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=reset_pool)
+
+
+def set_endpoint_url(service, endpoint_url):
+    """Points all pooled clients and resources of a service at endpoint_url, ex. a local S3 stand-in.
+    Usage:
+    set_endpoint_url('s3', 'http://localhost:5000')
+    set_endpoint_url('s3', None)  # back to AWS
+    """
+    with _pool_lock:
+        _endpoint_urls[service] = endpoint_url
+        for key in [key for key in _clients if key[2] == service]:
+            del _clients[key]
+
+
+def _get_session(profile):
+    # Caller holds _pool_lock, sessions aren't safe to share while creating clients
     if profile is None:
-        ssmclient = boto3.client('ssm', region_name=region)
-    else:
-        session = boto3.session.Session(profile_name=profile)
-        ssmclient = session.client('ssm', region_name=region)
-    value = ssmclient.get_parameter(Name=parameter_name, WithDecryption=True)['Parameter']['Value']
-    return value
+        return boto3._get_default_session()  # Same as boto3.client/resource, honours boto3.setup_default_session
+    if profile not in _sessions:
+        _sessions[profile] = boto3.session.Session(profile_name=profile)
+    return _sessions[profile]
+
+
+def get_client(service, profile=None, region=None, endpoint_url=None):
+    """Pooled, thread-safe boto3 client for (profile, region, service). endpoint_url defaults to set_endpoint_url's."""
+    endpoint_url = endpoint_url or _endpoint_urls.get(service)
+    key = (profile, region, service, endpoint_url)
+    client = _clients.get(key)
+    if client is None:
+        with _pool_lock:
+            client = _clients.get(key)
+            if client is None:
+                client = _get_session(profile).client(service, region_name=region, endpoint_url=endpoint_url)
+                _clients[key] = client
+    return client
+
+
+def get_resource(service, profile=None, region=None, endpoint_url=None):
+    """Pooled boto3 resource for (profile, region, service), one per thread."""
+    endpoint_url = endpoint_url or _endpoint_urls.get(service)
+    key = (profile, region, service, endpoint_url)
+    resources = _resources.__dict__
+    if key not in resources:
+        with _pool_lock:
+            resources[key] = _get_session(profile).resource(service, region_name=region, endpoint_url=endpoint_url)
+    return resources[key]
+
+
+# Decrypted SSM parameter values keyed by (profile, resolved region, name), as (value, fetched_at)
+_parameter_cache = {}
+PARAMETER_TTL = 300
 
-def get_s3_resource(profile):
+
+def _get_cached_parameter(ssmclient, profile, name, ttl):
+    # The client's region, so region=None and the default region named explicitly share entries
+    cached = _parameter_cache.get((profile, ssmclient.meta.region_name, name))
+    if cached is not None and ttl and time.time() - cached[1] < ttl:
+        return cached[0]
+    return None
+
+
+def _cache_parameters(ssmclient, profile, parameters):
+    fetched_at = time.time()
+    for parameter in parameters:
+        _parameter_cache[(profile, ssmclient.meta.region_name, parameter['Name'])] = (parameter['Value'], fetched_at)
+
+
+def clear_parameter_cache():
+    _parameter_cache.clear()
+
+
+def set_parameter_value_kms(parameter_name, value, region=None, profile=None, overwrite=True):
+    ssmclient = get_client('ssm', profile=profile, region=region)
+    ssmclient.put_parameter(Name=parameter_name, Value=value, Type='SecureString', Overwrite=overwrite)
+    _parameter_cache.pop((profile, ssmclient.meta.region_name, parameter_name), None)
+
+
+def get_parameter_value_kms(parameter_name, region, profile=None, ttl=0):
+    """ttl: seconds a value cached by any of the parameter functions is reused for, 0 always calls SSM."""
+    ssmclient = get_client('ssm', profile=profile, region=region)
+    value = _get_cached_parameter(ssmclient, profile, parameter_name, ttl)
+    if value is not None:
+        return value
+    parameter = ssmclient.get_parameter(Name=parameter_name, WithDecryption=True)['Parameter']
+    _cache_parameters(ssmclient, profile, [parameter])
+    return parameter['Value']
+
+
+def get_parameters(parameter_names, region, profile=None, ttl=PARAMETER_TTL):
+    '''Decrypted values of many parameters, fetched 10 per call (the SSM limit) and cached for ttl seconds.
+
+    :param parameter_names: list of parameter names
+    :param region:
+    :param profile:
+    :param ttl: seconds cached values are reused for, 0 always calls SSM
+    :return: dict of parameter name to value
+    '''
+    ssmclient = get_client('ssm', profile=profile, region=region)
+    values = {}
+    missing = []
+    for name in parameter_names:
+        value = _get_cached_parameter(ssmclient, profile, name, ttl)
+        if value is None:
+            missing.append(name)
+        else:
+            values[name] = value
+
+    invalid = []
+    for i in range(0, len(missing), 10):
+        response = ssmclient.get_parameters(Names=missing[i:i + 10], WithDecryption=True)
+        _cache_parameters(ssmclient, profile, response['Parameters'])
+        values.update((parameter['Name'], parameter['Value']) for parameter in response['Parameters'])
+        invalid.extend(response.get('InvalidParameters', []))
+    if invalid:
+        raise KeyError('Parameters not found: %s' % ', '.join(invalid))
+    return values
+
+
+def prefetch_parameters_by_path(path, region, profile=None, recursive=True):
+    '''Fetches and caches every parameter under a path in a few paginated calls, ex. at service startup.
+
+    :param path: ex. "/my-service/prod/"
+    :param region:
+    :param profile:
+    :param recursive: include parameters in nested paths
+    :return: dict of parameter name to value
+    '''
+    ssmclient = get_client('ssm', profile=profile, region=region)
+    values = {}
+    for page in ssmclient.get_paginator('get_parameters_by_path').paginate(Path=path, Recursive=recursive,
+                                                                           WithDecryption=True):
+        _cache_parameters(ssmclient, profile, page['Parameters'])
+        values.update((parameter['Name'], parameter['Value']) for parameter in page['Parameters'])
+    return values
+
+
+def get_s3_resource(profile, region=None):
     '''
 
     :param profile: profile name to be provided
-    :return: s3 resource instance which could be from default session or profile specific
+    :param region:
+    :return: pooled s3 resource instance which could be from default session or profile specific
     '''
-    if profile is None:
-        s3 = boto3.resource('s3')
-    else:
-        session = boto3.session.Session(profile_name=profile)
-        s3 = session.resource('s3')
-    return s3
+    return get_resource('s3', profile=profile, region=region)
 
-def get_s3_client(profile):
+def get_s3_client(profile, region=None):
     '''
 
     :param profile: profile name to be provided
-    :return: s3 client instance which could be from default session or profile specific
+    :param region:
+    :return: pooled s3 client instance which could be from default session or profile specific
     '''
-    if profile is None:
-        s3 = boto3.client('s3')
-    else:
-        session = boto3.session.Session(profile_name=profile)
-        s3 = session.client('s3')
-
-    return s3
+    return get_client('s3', profile=profile, region=region)
 
 def split_s3_bucket_key(uri):
     '''
@@ -64,41 +210,121 @@ def get_filelist_from_s3_bucket(bucketname, profile=None):
     :param profile:
     :return: list of keys
     '''
-    s3 = get_s3_resource(profile)
-    files = []
-    for object in s3.Bucket(bucketname).objects.all():
-        files.append(object.key)
-    return files
+    return [obj['Key'] for obj in iter_s3_objects(bucketname, profile=profile)]
 
 
 def get_all_s3_keys(bucketname,profile=None):
-    """Get a list of all keys in an S3 bucket."""
-    keys = []
-    s3=get_s3_client(profile)
-    kwargs = {'Bucket': bucketname}
-    while True:
-        resp = s3.list_objects_v2(**kwargs)
-        for obj in resp['Contents']:
-            keys.append(obj['Key'])
+    """Get a list of all keys in an S3 bucket. Prefer iter_s3_objects for big buckets."""
+    return [obj['Key'] for obj in iter_s3_objects(bucketname, profile=profile)]
 
-        try:
-            kwargs['ContinuationToken'] = resp['NextContinuationToken']
-        except KeyError:
-            break
 
-    return keys
+def _iter_list_pages(bucketname, prefix='', delimiter=None, profile=None, page_size=1000):
+    kwargs = {'Bucket': bucketname, 'Prefix': prefix, 'PaginationConfig': {'PageSize': page_size}}
+    if delimiter:
+        kwargs['Delimiter'] = delimiter
+    return get_s3_client(profile).get_paginator('list_objects_v2').paginate(**kwargs)
+
 
+def iter_s3_objects(bucketname, prefix='', delimiter=None, profile=None, page_size=1000):
+    '''Generator of object metadata fetched lazily page by page, so only one page of keys is held in memory.
 
-def get_s3_file_contents(s3_filename, encoding='utf-8', profile=None):
+    :param bucketname:
+    :param prefix: only keys starting with prefix
+    :param delimiter: ex. "/", keys containing it after the prefix are grouped instead, see list_s3_prefixes
+    :param profile:
+    :param page_size: keys per list request, at most 1000
+    :return: dicts with Key, Size, ETag, LastModified and StorageClass
+    '''
+    for page in _iter_list_pages(bucketname, prefix, delimiter, profile, page_size):
+        for obj in page.get('Contents', []):
+            yield obj
+
+
+def list_s3_prefixes(bucketname, prefix='', delimiter='/', profile=None):
+    """Sub-prefixes directly below prefix, ex. ['data/2019/', 'data/2020/'] for prefix 'data/'."""
+    return [common['Prefix'] for page in _iter_list_pages(bucketname, prefix, delimiter, profile)
+            for common in page.get('CommonPrefixes', [])]
+
+
+_LISTING_DONE = object()
+
+
+def iter_s3_objects_parallel(bucketname, prefix='', delimiter='/', prefixes=None, profile=None, max_workers=8):
+    '''Like iter_s3_objects, but lists sub-prefixes in parallel threads. Objects of different sub-prefixes interleave.
+
+    :param bucketname:
+    :param prefix: listed with delimiter to find the sub-prefixes to shard on, objects directly under it come first
+    :param delimiter:
+    :param prefixes: known sub-prefixes to list instead of discovering them from prefix
+    :param profile:
+    :param max_workers: sub-prefixes listed at a time, at most 2 * max_workers pages are buffered
+    :return: dicts with Key, Size, ETag, LastModified and StorageClass
+    '''
+    if prefixes is None:
+        prefixes = []
+        for page in _iter_list_pages(bucketname, prefix, delimiter, profile):
+            for obj in page.get('Contents', []):
+                yield obj
+            prefixes.extend(common['Prefix'] for common in page.get('CommonPrefixes', []))
+
+    pages = queue.Queue(maxsize=2 * max_workers)
+    stop = threading.Event()
+
+    def put(item):
+        # Blocks while the consumer is behind, gives up once it has stopped
+        while not stop.is_set():
+            try:
+                pages.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def list_prefix(sub_prefix):
+        if stop.is_set():
+            return  # Consumer stopped before this job left the executor queue
+        try:
+            for page in _iter_list_pages(bucketname, sub_prefix, profile=profile):
+                # Checked before each next page too, every page is another list_objects_v2 request
+                if not put(page.get('Contents', [])) or stop.is_set():
+                    return
+        except Exception as e:
+            put(e)
+        else:
+            put(_LISTING_DONE)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for sub_prefix in prefixes:
+            executor.submit(list_prefix, sub_prefix)
+        try:
+            remaining = len(prefixes)
+            while remaining:
+                item = pages.get()
+                if item is _LISTING_DONE:
+                    remaining -= 1
+                elif isinstance(item, Exception):
+                    raise item
+                else:
+                    for obj in item:
+                        yield obj
+        finally:
+            stop.set()
+
+
+def get_s3_file_contents(s3_filename, encoding='utf-8', profile=None, cache=None):
     """Get a file from AWS.
 
     :param s3_filename: filename in format "s3://.../../" or "s3a://.../.../"
     :param encoding:
     :param profile:
+    :param cache: S3Cache to serve the file from local disk when it hasn't changed
     :returns: File contents in a string
 
     Note: this is designed only for small config files, etc.
+    For big files use iter_s3_file_lines, iter_s3_file_chunks or read_s3_csv_chunks.
     """
+    if cache is not None:
+        return cache.get_contents(s3_filename, encoding=encoding, profile=profile)
     print("loading {0} from s3".format(s3_filename))
     bucket, key = split_s3_bucket_key(s3_filename)
     s3=get_s3_resource(profile)
@@ -108,18 +334,136 @@ def get_s3_file_contents(s3_filename, encoding='utf-8', profile=None):
     return contents
 
 
-def download_file_from_s3(s3_filename, downloaded_file, profile=None):
+def _get_s3_body(s3_filename, start=None, end=None, profile=None):
+    bucket, key = split_s3_bucket_key(s3_filename)
+    kwargs = {'Bucket': bucket, 'Key': key}
+    if start is not None or end is not None:
+        kwargs['Range'] = 'bytes=%s-%s' % (start or 0, '' if end is None else end)
+    return get_s3_client(profile).get_object(**kwargs)['Body']
+
+
+def open_s3_file(s3_filename, encoding=None, start=None, end=None, profile=None):
+    '''File-like object streaming an S3 object without downloading it or reading it all into memory.
+
+    :param s3_filename: filename in format "s3://.../../" or "s3a://.../.../"
+    :param encoding: binary stream if None, else a text stream decoded with encoding
+    :param start: first byte to read, for ranged reads
+    :param end: last byte to read (inclusive), ex. start=0, end=1023 for the first 1 KB
+    :param profile:
+    :return: readable stream, close it when done
+    '''
+    body = _get_s3_body(s3_filename, start=start, end=end, profile=profile)
+    return body if encoding is None else io.TextIOWrapper(body, encoding=encoding)
+
+
+def iter_s3_file_chunks(s3_filename, chunk_size=MB, start=None, end=None, profile=None):
+    """Generator of fixed-size byte chunks of an S3 object, or of the byte range start-end of it."""
+    body = _get_s3_body(s3_filename, start=start, end=end, profile=profile)
+    try:
+        for chunk in body.iter_chunks(chunk_size):
+            yield chunk
+    finally:
+        body.close()
+
+
+def iter_s3_file_lines(s3_filename, encoding='utf-8', start=None, end=None, profile=None, chunk_size=MB):
+    """Generator of decoded lines (without line endings) of an S3 object, ex. a big CSV or JSON Lines file.
+    With a byte range, yields the lines that start inside it, reading past end to finish the last one. So the ranges
+    of split_s3_byte_ranges can be read in parallel with every line read once and whole. Lines are split on b'\\n'
+    before decoding, so encoding has to be ASCII compatible, ex. utf-8 or latin-1.
+    The ranged GET stops chunk_size bytes after end, with more GETs of chunk_size only if the last line is longer.
+    """
+    start = start or 0
+    offset = max(start - 1, 0)  # From the byte before start, to tell if a line starts exactly at start
+    chunks = _iter_s3_chunks(s3_filename, offset, end, profile, chunk_size)
+    lines = _iter_raw_lines(chunks)
+    try:
+        if start > 0:
+            offset += len(next(lines, b'')) + 1  # Rest of a line that started in the previous range
+        while end is None or offset <= end:  # Checked before reading on, so a long next line is not fetched
+            line = next(lines, None)
+            if line is None:
+                break
+            offset += len(line) + 1
+            yield line.decode(encoding).rstrip('\r')
+    finally:
+        chunks.close()
+
+
+def _iter_s3_chunks(s3_filename, start, end, profile, chunk_size):
+    """Chunks of the object from start, in GETs up to end + chunk_size and then chunk_size each, while read."""
+    last = None if end is None else end + chunk_size
+    while True:
+        try:
+            body = _get_s3_body(s3_filename, start=start or None, end=last, profile=profile)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') == 'InvalidRange':  # start is past the end of the object
+                return
+            raise
+        size = 0
+        try:
+            for chunk in body.iter_chunks(chunk_size):
+                size += len(chunk)
+                yield chunk
+        finally:
+            body.close()
+        if last is None or size < last - start + 1:
+            return
+        start, last = last + 1, last + chunk_size
+
+
+def _iter_raw_lines(chunks):
+    pending = b''
+    for chunk in chunks:
+        lines = (pending + chunk).split(b'\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line
+    if pending:
+        yield pending
+
+
+def read_s3_csv_chunks(s3_filename, chunksize=100000, profile=None, **kwargs):
+    """Iterator of DataFrames of chunksize rows read straight from S3. kwargs are passed to pandas.read_csv."""
+    return pd.read_csv(open_s3_file(s3_filename, profile=profile), chunksize=chunksize, **kwargs)
+
+
+def get_s3_file_size(s3_filename, profile=None):
+    bucket, key = split_s3_bucket_key(s3_filename)
+    return get_s3_client(profile).head_object(Bucket=bucket, Key=key)['ContentLength']
+
+
+def split_s3_byte_ranges(s3_filename, n_parts, profile=None):
+    '''
+
+    :param s3_filename: filename in format "s3://.../../" or "s3a://.../.../"
+    :param n_parts:
+    :param profile:
+    :return: list of up to n_parts inclusive (start, end) byte ranges covering the object, for parallel ranged reads.
+        The ranges split bytes, not characters or lines. Read them with iter_s3_file_lines to get whole lines, or
+        as bytes with iter_s3_file_chunks.
+    '''
+    size = get_s3_file_size(s3_filename, profile=profile)
+    part_size = -(-size // n_parts) if size else 0
+    return [(start, min(start + part_size, size) - 1) for start in range(0, size, part_size or 1)]
+
+
+def download_file_from_s3(s3_filename, downloaded_file, profile=None, transfer_config=None, cache=None):
     '''
 
     :param s3_filename: s3 file link  in format "s3://.../../" or "s3a://.../.../"
     :param downloaded_file: download as filename
     :param profile:
+    :param transfer_config: multipart settings, see get_transfer_config
+    :param cache: S3Cache to copy the file from local disk when it hasn't changed
     :return:
     '''
+    if cache is not None:
+        return cache.download(s3_filename, downloaded_file, profile=profile)
     try:
         s3 = get_s3_resource(profile)
         bucket, key = split_s3_bucket_key(s3_filename)
-        s3.Bucket(bucket).download_file(key, downloaded_file)
+        s3.Bucket(bucket).download_file(key, downloaded_file, Config=transfer_config)
     except Exception as e:
         print(e)
         raise AssertionError("Unable to download the file")
@@ -127,7 +471,7 @@ def download_file_from_s3(s3_filename, downloaded_file, profile=None):
 
 
 
-def upload_file_to_s3(file_to_upload, bucketname, key_, content_type=None, make_public=False, profile=None):
+def upload_file_to_s3(file_to_upload, bucketname, key_, content_type=None, make_public=False, profile=None, transfer_config=None):
     '''
 
     :param file_to_upload:
@@ -136,6 +480,7 @@ def upload_file_to_s3(file_to_upload, bucketname, key_, content_type=None, make_
     :param content_type: string
     :param make_public: bool
     :param profile:
+    :param transfer_config: multipart settings, see get_transfer_config
     :return: downaloadable S3 file link
     '''
     try:
@@ -147,9 +492,330 @@ def upload_file_to_s3(file_to_upload, bucketname, key_, content_type=None, make_
         if content_type!=None:
             extra_args['ContentType'] = content_type
 
-        s3.meta.client.upload_file(file_to_upload, bucketname, key_, ExtraArgs=extra_args)
+        s3.meta.client.upload_file(file_to_upload, bucketname, key_, ExtraArgs=extra_args, Config=transfer_config)
         downloadable_file_path = "/".join(["https://s3.amazonaws.com", bucketname, key_])
         return downloadable_file_path
     except Exception as e:
         print(e)
         raise AssertionError("Unable to upload the file")
+
+
+def get_transfer_config(chunk_size_mb=8, max_concurrency=10):
+    '''
+
+    :param chunk_size_mb: multipart part size, files bigger than this are transferred in parts
+    :param max_concurrency: threads used for the parts of one file
+    :return: boto3 TransferConfig
+    '''
+    return TransferConfig(multipart_threshold=chunk_size_mb * MB, multipart_chunksize=chunk_size_mb * MB,
+                          max_concurrency=max_concurrency)
+
+
+def get_file_etag(file_path, chunk_size=8 * MB, multipart=False):
+    """S3 style ETag of a local file. MD5 of the file, or for multipart uploads MD5 of the part MD5s with a -parts suffix."""
+    md5 = hashlib.md5()
+    part_md5s = []
+    with open(file_path, 'rb') as f:
+        for part in iter(lambda: f.read(chunk_size), b''):
+            md5.update(part)
+            part_md5s.append(hashlib.md5(part).digest())
+    if not multipart:
+        return md5.hexdigest()
+    return '%s-%d' % (hashlib.md5(b''.join(part_md5s)).hexdigest(), len(part_md5s))
+
+
+def _is_in_sync(file_path, size, etag=None, chunk_size=8 * MB):
+    """Local file matches an S3 object by size, and by ETag if given."""
+    if not os.path.isfile(file_path) or os.path.getsize(file_path) != size:
+        return False
+    if etag is None:
+        return True
+    etag = etag.strip('"')
+    return get_file_etag(file_path, chunk_size=chunk_size, multipart='-' in etag) == etag
+
+
+class TransferProgress:
+    """Thread-safe aggregate progress of a bulk transfer, printed at most every interval seconds."""
+
+    def __init__(self, action, total_files, total_bytes, interval=10):
+        self.action = action
+        self.total_files = total_files
+        self.total_bytes = total_bytes
+        self.interval = interval
+        self.files = self.skipped = self.failed = self.bytes = 0
+        self.start = self._last_print = time.time()
+        self._lock = threading.Lock()
+
+    def add_bytes(self, n):
+        """boto3 transfer Callback."""
+        with self._lock:
+            self.bytes += n
+        if time.time() - self._last_print >= self.interval:
+            self._last_print = time.time()
+            self.print_progress()
+
+    def file_done(self, skipped=False, failed=False):
+        with self._lock:
+            self.files += 1
+            self.skipped += skipped
+            self.failed += failed
+
+    def summary(self):
+        seconds = time.time() - self.start
+        return {'files': self.files, 'total_files': self.total_files, 'skipped': self.skipped, 'failed': self.failed,
+                'bytes': self.bytes, 'total_bytes': self.total_bytes, 'seconds': seconds,
+                'mb_per_sec': self.bytes / MB / seconds if seconds else 0.0}
+
+    def print_progress(self):
+        s = self.summary()
+        print('%s %d/%d files (%d skipped, %d failed), %.1f/%.1f MB, %.1f MB/s' % (
+            self.action, s['files'], s['total_files'], s['skipped'], s['failed'], s['bytes'] / MB,
+            s['total_bytes'] / MB, s['mb_per_sec']))
+
+
+def _run_transfers(transfer, items, progress, max_workers):
+    failures = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(transfer, item): item for item in items}
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                print(e)
+                failures.append(futures[future])
+                progress.file_done(failed=True)
+    progress.print_progress()
+    if failures:
+        raise AssertionError("Unable to transfer %d files" % len(failures))
+    return progress.summary()
+
+
+def download_prefix(s3_prefix, local_directory, profile=None, max_workers=8, chunk_size_mb=8, max_concurrency=4,
+                    skip_existing=True, check_etag=True, progress_interval=10):
+    '''Downloads every object under an S3 prefix, keeping the key structure below the prefix.
+
+    :param s3_prefix: s3 prefix in format "s3://bucket/prefix/"
+    :param local_directory:
+    :param profile:
+    :param max_workers: files transferred in parallel
+    :param chunk_size_mb: multipart part size
+    :param max_concurrency: threads per file for multipart parts
+    :param skip_existing: skips local files already in sync by size, and ETag if check_etag
+    :param check_etag:
+    :param progress_interval: seconds between progress lines
+    :return: summary dict with files, skipped, failed, bytes, seconds and mb_per_sec
+    '''
+    bucket, prefix = split_s3_bucket_key(s3_prefix)
+    objects = [obj for obj in iter_s3_objects(bucket, prefix, profile=profile) if not obj['Key'].endswith('/')]
+    client = get_s3_client(profile)
+    config = get_transfer_config(chunk_size_mb=chunk_size_mb, max_concurrency=max_concurrency)
+    progress = TransferProgress('Downloaded', len(objects), sum(obj['Size'] for obj in objects), progress_interval)
+
+    def download(obj):
+        relative_parts = obj['Key'][len(prefix):].lstrip('/').split('/')
+        if '..' in relative_parts:
+            raise ValueError('Refusing to download %s outside %s' % (obj['Key'], local_directory))
+        file_path = os.path.join(local_directory, *relative_parts)
+        etag = obj['ETag'] if check_etag else None
+        if skip_existing and _is_in_sync(file_path, obj['Size'], etag, chunk_size=chunk_size_mb * MB):
+            progress.file_done(skipped=True)
+            return
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        client.download_file(bucket, obj['Key'], file_path, Config=config, Callback=progress.add_bytes)
+        progress.file_done()
+
+    return _run_transfers(download, objects, progress, max_workers)
+
+
+def upload_directory(local_directory, bucketname, prefix='', profile=None, max_workers=8, chunk_size_mb=8,
+                     max_concurrency=4, skip_existing=True, check_etag=True, extra_args=None, progress_interval=10):
+    '''Uploads every file in a directory tree under an S3 prefix, keeping the folder structure.
+
+    :param local_directory:
+    :param bucketname:
+    :param prefix: key prefix, ex. "models/v2"
+    :param profile:
+    :param max_workers: files transferred in parallel
+    :param chunk_size_mb: multipart part size
+    :param max_concurrency: threads per file for multipart parts
+    :param skip_existing: skips files whose S3 object is already in sync by size, and ETag if check_etag
+    :param check_etag:
+    :param extra_args: boto3 ExtraArgs for every file, ex. {'ContentType': 'text/csv'}
+    :param progress_interval: seconds between progress lines
+    :return: summary dict with files, skipped, failed, bytes, seconds and mb_per_sec
+    '''
+    files = []
+    for root, _, names in os.walk(local_directory):
+        for name in names:
+            file_path = os.path.join(root, name)
+            relative_key = os.path.relpath(file_path, local_directory).replace(os.sep, '/')
+            files.append((file_path, '/'.join(filter(None, [prefix.rstrip('/'), relative_key]))))
+    existing = {}
+    if skip_existing:
+        existing = {obj['Key']: obj for obj in iter_s3_objects(bucketname, prefix, profile=profile)}
+    client = get_s3_client(profile)
+    config = get_transfer_config(chunk_size_mb=chunk_size_mb, max_concurrency=max_concurrency)
+    progress = TransferProgress('Uploaded', len(files), sum(os.path.getsize(f) for f, _ in files), progress_interval)
+
+    def upload(item):
+        file_path, key = item
+        obj = existing.get(key)
+        if obj is not None:
+            etag = obj['ETag'] if check_etag else None
+            if _is_in_sync(file_path, obj['Size'], etag, chunk_size=chunk_size_mb * MB):
+                progress.file_done(skipped=True)
+                return
+        client.upload_file(file_path, bucketname, key, ExtraArgs=extra_args, Config=config, Callback=progress.add_bytes)
+        progress.file_done()
+
+    return _run_transfers(upload, files, progress, max_workers)
+
+
+class S3Cache:
+    """On-disk cache of S3 objects shared by all processes on a host.
+
+    Entries are validated against the object ETag with a HEAD request, or trusted without one for ttl seconds.
+    Files are written to a temp file and renamed, so concurrent processes never see partial entries.
+    Least recently used entries are evicted once the cache is bigger than max_size_mb.
+    Usage:
+    cache = S3Cache('/mnt/cache/s3', max_size_mb=20000, ttl=600)
+    model_path = cache.get_path('s3://bucket/models/model.h5')
+    config = get_s3_file_contents('s3://bucket/config.json', cache=cache)
+    """
+
+    def __init__(self, directory=None, max_size_mb=10240, ttl=None, profile=None, transfer_config=None):
+        self.directory = directory or os.environ.get('PSY_S3_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'psyduck', 's3'))
+        self.max_size = max_size_mb * MB
+        self.ttl = ttl
+        self.profile = profile
+        self.transfer_config = transfer_config
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.validations = self.evictions = 0
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _entry_paths(self, s3_filename):
+        name = hashlib.sha1(s3_filename.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, name + '.data'), os.path.join(self.directory, name + '.json')
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _tmp_path(self, path):
+        return '%s.%d.%d.tmp' % (path, os.getpid(), threading.get_ident())
+
+    def _write_meta(self, meta_path, meta):
+        tmp_path = self._tmp_path(meta_path)
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, meta_path)
+
+    def _read_meta(self, meta_path):
+        try:
+            with open(meta_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _is_fresh(self, s3_filename, data_path, meta_path, meta, profile):
+        if meta is None or not os.path.exists(data_path):
+            return False
+        if self.ttl is not None and time.time() - meta['validated_at'] < self.ttl:
+            return True
+        self._count('validations')
+        bucket, key = split_s3_bucket_key(s3_filename)
+        etag = get_s3_client(profile).head_object(Bucket=bucket, Key=key)['ETag']
+        if etag != meta['etag']:
+            return False
+        meta['validated_at'] = time.time()
+        self._write_meta(meta_path, meta)
+        return True
+
+    def get_path(self, s3_filename, profile=None):
+        """Local path of an up to date copy of s3_filename, downloaded if missing or changed. Treat it as read-only.
+        Another process may evict it at any time, use get_contents or download to read it safely.
+        profile: defaults to the cache's profile
+        """
+        profile = profile or self.profile
+        data_path, meta_path = self._entry_paths(s3_filename)
+        if self._is_fresh(s3_filename, data_path, meta_path, self._read_meta(meta_path), profile):
+            try:
+                os.utime(data_path)  # mtime is the LRU clock, shared across processes
+                self._count('hits')
+                return data_path
+            except FileNotFoundError:
+                pass  # Evicted by another process since the check
+
+        self._count('misses')
+        print("caching {0} from s3".format(s3_filename))
+        bucket, key = split_s3_bucket_key(s3_filename)
+        client = get_s3_client(profile)
+        etag = client.head_object(Bucket=bucket, Key=key)['ETag']
+        tmp_path = self._tmp_path(data_path)
+        try:
+            client.download_file(bucket, key, tmp_path, Config=self.transfer_config)
+            os.replace(tmp_path, data_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self._write_meta(meta_path, {'s3_filename': s3_filename, 'etag': etag, 'validated_at': time.time()})
+        self.evict(keep=data_path)
+        return data_path
+
+    def _open(self, s3_filename, profile=None, attempts=3):
+        """Opened entry, fetched again if another process evicts it between get_path and open."""
+        for attempt in range(attempts):
+            try:
+                return open(self.get_path(s3_filename, profile=profile), 'rb')
+            except FileNotFoundError:
+                if attempt == attempts - 1:
+                    raise
+
+    def get_contents(self, s3_filename, encoding='utf-8', profile=None):
+        with self._open(s3_filename, profile=profile) as f:
+            return f.read().decode(encoding)
+
+    def download(self, s3_filename, downloaded_file, profile=None):
+        with self._open(s3_filename, profile=profile) as src, open(downloaded_file, 'wb') as dest:
+            shutil.copyfileobj(src, dest)
+
+    def evict(self, keep=None):
+        """Deletes least recently used entries until the cache fits in max_size_mb. Returns number of entries deleted."""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.data') and entry.path != keep:
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue  # Evicted by another process while scanning
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        if keep:
+            try:
+                total += os.path.getsize(keep)
+            except FileNotFoundError:
+                pass
+        evicted = 0
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            for entry_path in (path, path[:-len('.data')] + '.json'):
+                try:
+                    os.remove(entry_path)
+                except FileNotFoundError:
+                    pass  # Another process evicted it first
+            total -= size
+            evicted += 1
+        with self._lock:
+            self.evictions += evicted
+        return evicted
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses, 'validations': self.validations,
+                    'evictions': self.evictions, 'hit_rate': self.hits / total if total else 0.0}
+
+    def clear(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+        os.makedirs(self.directory, exist_ok=True)
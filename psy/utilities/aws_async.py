@@ -0,0 +1,98 @@
+"""asyncio versions of the S3 and SSM functions in psy.utilities.aws.
+
+Calls run on a bounded, process-wide thread pool, so at most max_concurrency AWS requests are in flight and
+the event loop is never blocked. boto3 clients are shared through the aws client pool.
+Usage:
+contents = await aws_async.get_s3_files_contents(['s3://bucket/a.json', 's3://bucket/b.json'])
+"""
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from psy.utilities import aws
+
+DEFAULT_CONCURRENCY = 32
+
+_executor = None
+_executor_lock = threading.Lock()
+_max_concurrency = DEFAULT_CONCURRENCY
+
+
+def set_concurrency(max_concurrency):
+    """Maximum number of AWS calls running at once across all coroutines."""
+    global _executor, _max_concurrency
+    with _executor_lock:
+        _max_concurrency = max_concurrency
+        old_executor, _executor = _executor, None
+    if old_executor is not None:
+        old_executor.shutdown(wait=False)
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=_max_concurrency, thread_name_prefix='psy-aws')
+    return _executor
+
+
+def _reset_executor():
+    global _executor, _executor_lock
+    _executor = None
+    _executor_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_executor)
+
+
+async def _run(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), partial(func, *args, **kwargs))
+
+
+async def get_s3_file_contents(s3_filename, encoding='utf-8', profile=None, cache=None):
+    return await _run(aws.get_s3_file_contents, s3_filename, encoding=encoding, profile=profile, cache=cache)
+
+
+async def get_s3_files_contents(s3_filenames, encoding='utf-8', profile=None, cache=None):
+    """Contents of many small files fetched concurrently, in the order of s3_filenames."""
+    return await asyncio.gather(*[get_s3_file_contents(s3_filename, encoding=encoding, profile=profile, cache=cache)
+                                  for s3_filename in s3_filenames])
+
+
+async def download_file_from_s3(s3_filename, downloaded_file, profile=None, transfer_config=None, cache=None):
+    return await _run(aws.download_file_from_s3, s3_filename, downloaded_file, profile=profile,
+                      transfer_config=transfer_config, cache=cache)
+
+
+async def upload_file_to_s3(file_to_upload, bucketname, key_, content_type=None, make_public=False, profile=None,
+                            transfer_config=None):
+    return await _run(aws.upload_file_to_s3, file_to_upload, bucketname, key_, content_type=content_type,
+                      make_public=make_public, profile=profile, transfer_config=transfer_config)
+
+
+async def iter_s3_objects(bucketname, prefix='', delimiter=None, profile=None, page_size=1000):
+    """Async generator of object metadata, fetching one list page at a time off the event loop."""
+    pages = iter(aws._iter_list_pages(bucketname, prefix, delimiter, profile, page_size))
+    while True:
+        page = await _run(next, pages, None)
+        if page is None:
+            break
+        for obj in page.get('Contents', []):
+            yield obj
+
+
+async def get_all_s3_keys(bucketname, prefix='', profile=None):
+    return [obj['Key'] async for obj in iter_s3_objects(bucketname, prefix=prefix, profile=profile)]
+
+
+async def get_parameter_value_kms(parameter_name, region, profile=None, ttl=0):
+    return await _run(aws.get_parameter_value_kms, parameter_name, region, profile=profile, ttl=ttl)
+
+
+async def get_parameters(parameter_names, region, profile=None, ttl=aws.PARAMETER_TTL):
+    return await _run(aws.get_parameters, parameter_names, region, profile=profile, ttl=ttl)
@@ -1,35 +1,82 @@
+import bz2
 import datetime
 import glob
+import gzip
 import json
+import lzma
+import mmap
 import multiprocessing
 import os
 import pickle
+import re
 import shutil
+import threading
 import time
+import uuid
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from functools import wraps
 
 import pandas as pd
 import requests
 from dateutil.relativedelta import relativedelta
 from pytz import timezone
-
-
-def delete_contents(path, delete_files=True, delete_folders=True, delete_itself=False):
-    '''Delete contents in a directory'''
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import orjson  # Optional, much faster JSON backend
+except ImportError:
+    orjson = None
+
+
+def _map_io(func, items, n_jobs=1):
+    """Maps func over items, on a thread pool if n_jobs > 1 since file system calls release the GIL."""
+    if n_jobs > 1:
+        with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+            return list(executor.map(func, items))
+    return [func(item) for item in items]
+
+
+def delete_contents(path, delete_files=True, delete_folders=True, delete_itself=False, n_jobs=1, dry_run=False,
+                    include_hidden=False):
+    '''Delete contents in a directory
+    delete_files: deletes files and symlinks, including ones without an extension
+    delete_folders: deletes sub folders with everything inside them
+    include_hidden: also deletes entries starting with a dot, ex. .gitkeep, .env or .git, which are kept by default
+    n_jobs: threads deleting entries in parallel
+    dry_run: only prints and returns what would be deleted
+    Returns list of deleted paths
+    '''
     print('Cleaning', path)
-    if os.path.isdir(path):
-        if delete_itself:
+    if not os.path.isdir(path):
+        return []
+    if delete_itself:
+        if not dry_run:
             shutil.rmtree(path)
+        return [path]
+
+    to_delete = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.name.startswith('.') and not include_hidden:
+                continue
+            is_folder = entry.is_dir(follow_symlinks=False)
+            if (is_folder and delete_folders) or (not is_folder and delete_files):
+                to_delete.append((entry.path, is_folder))
+
+    def delete(item):
+        entry_path, is_folder = item
+        if dry_run:
+            print('Would delete', entry_path)
+        elif is_folder:
+            shutil.rmtree(entry_path)
         else:
-            if delete_files:
-                files = glob.glob('%s/*.*' % path)
-                for f in files:
-                    os.remove(f)
-            if delete_folders:
-                folders = glob.glob('%s/*' % path)
-                for f in folders:
-                    os.rmdir(f)
+            os.remove(entry_path)
+        return entry_path
+
+    return _map_io(delete, to_delete, n_jobs=n_jobs)
 
 
 def create_folder(directory, delete_old=False):
@@ -43,14 +90,80 @@ def create_folder(directory, delete_old=False):
         print('Directory exists.' + directory)
 
 
-def copy_folder(src, dest, symlinks=False, ignore=None):
-    for item in os.listdir(src):
-        s = os.path.join(src, item)
-        d = os.path.join(dest, item)
-        if os.path.isdir(s):
-            shutil.copytree(s, d, symlinks, ignore)
+def _scan_tree(src, dest, symlinks=False, ignore=None):
+    """Yields (kind, source, destination, stat) for everything below src with os.scandir, folders before their contents."""
+    stack = [(src, dest)]
+    while stack:
+        src_dir, dest_dir = stack.pop()
+        with os.scandir(src_dir) as it:
+            entries = list(it)
+        ignored = ignore(src_dir, [entry.name for entry in entries]) if ignore is not None else ()
+        for entry in entries:
+            if entry.name in ignored:
+                continue
+            dest_path = os.path.join(dest_dir, entry.name)
+            if symlinks and entry.is_symlink():
+                yield 'symlink', entry.path, dest_path, None
+            elif entry.is_dir():
+                yield 'folder', entry.path, dest_path, None
+                stack.append((entry.path, dest_path))
+            else:
+                yield 'file', entry.path, dest_path, entry.stat()
+
+
+def _is_same_file_version(src_stat, dest_path):
+    try:
+        dest_stat = os.stat(dest_path)
+    except FileNotFoundError:
+        return False
+    return dest_stat.st_size == src_stat.st_size and dest_stat.st_mtime_ns == src_stat.st_mtime_ns
+
+
+def copy_folder(src, dest, symlinks=False, ignore=None, incremental=False, hardlink=False, n_jobs=1, dry_run=False):
+    '''Copies the contents of src into dest, creating dest and merging into existing folders.
+    symlinks, ignore: as in shutil.copytree
+    incremental: skips files whose destination has the same size and modification time
+    hardlink: hard links files instead of copying, falls back to copying across file systems
+    n_jobs: threads copying files in parallel
+    dry_run: only prints and returns what would be done
+    Returns list of (action, source, destination) with action one of copy, link, skip or symlink
+    '''
+    files = []
+    for kind, src_path, dest_path, stat in _scan_tree(src, dest, symlinks=symlinks, ignore=ignore):
+        if kind == 'folder' and not dry_run:
+            os.makedirs(dest_path, exist_ok=True)
+        elif kind != 'folder':
+            files.append((kind, src_path, dest_path, stat))
+    if not dry_run:
+        os.makedirs(dest, exist_ok=True)
+
+    def copy(item):
+        kind, src_path, dest_path, stat = item
+        if kind == 'symlink':
+            action = 'symlink'
+        elif incremental and _is_same_file_version(stat, dest_path):
+            action = 'skip'
         else:
-            shutil.copy2(s, d)
+            action = 'link' if hardlink else 'copy'
+        if dry_run:
+            print('Would %s %s -> %s' % (action, src_path, dest_path))
+            return action, src_path, dest_path
+        if action == 'skip':
+            return action, src_path, dest_path
+        if os.path.lexists(dest_path):
+            os.remove(dest_path)
+        if action == 'symlink':
+            os.symlink(os.readlink(src_path), dest_path)
+        elif action == 'link':
+            try:
+                os.link(src_path, dest_path)
+            except OSError:
+                action = 'copy'  # Different file system
+        if action == 'copy':
+            shutil.copy2(src_path, dest_path)
+        return action, src_path, dest_path
+
+    return _map_io(copy, files, n_jobs=n_jobs)
 
 
 def get_command_output(cmd):
@@ -69,41 +182,218 @@ def shutdown(seconds=0, os='linux'):
         run_command('shutdown -s -t %s' % seconds)
 
 
-def timing(f):
-    """Decorator for timing functions
+_HISTOGRAM_BUCKETS = 64  # Bucket b holds durations in [2**(b-1), 2**b) ns
+
+
+class _TimingStat(object):
+    __slots__ = ('calls', 'samples', 'total_ns', 'min_ns', 'max_ns', 'buckets')
+
+    def __init__(self):
+        self.calls = 0
+        self.samples = 0
+        self.total_ns = 0
+        self.min_ns = None
+        self.max_ns = 0
+        self.buckets = [0] * _HISTOGRAM_BUCKETS
+
+    def percentile(self, q):
+        """Upper bound of the histogram bucket holding the q-th percentile, in ns."""
+        rank = q / 100 * self.samples
+        seen = 0
+        for b, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= rank:
+                return min(2 ** b, self.max_ns)
+        return self.max_ns
+
+
+class Profiler(object):
+    """Process-wide registry of call counts, total/min/max times and log2 latency histograms.
+
+    Timings are recorded with time.perf_counter_ns. Memory is constant per name, so it is safe in hot loops.
+    When disabled, decorated functions are called directly with a single attribute check of overhead.
     Usage:
-    @timing
-    def function(a):
-        pass
+    profiler.enabled = False
+    print(profiler.log_line())
+    profiler.to_prometheus()
     """
 
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _get_stat(self, name):
+        stat = self._stats.get(name)
+        if stat is None:
+            stat = self._stats.setdefault(name, _TimingStat())
+        return stat
+
+    def should_sample(self, name, sample_every):
+        """Counts a call of name and returns True for one in every sample_every calls."""
+        with self._lock:
+            stat = self._get_stat(name)
+            stat.calls += 1
+            return (stat.calls - 1) % sample_every == 0
+
+    def record(self, name, duration_ns, counted=False):
+        """Adds one timed call of name. counted=True if should_sample already counted the call."""
+        with self._lock:
+            stat = self._get_stat(name)
+            if not counted:
+                stat.calls += 1
+            stat.samples += 1
+            stat.total_ns += duration_ns
+            stat.min_ns = duration_ns if stat.min_ns is None else min(stat.min_ns, duration_ns)
+            stat.max_ns = max(stat.max_ns, duration_ns)
+            stat.buckets[min(duration_ns.bit_length(), _HISTOGRAM_BUCKETS - 1)] += 1
+
+    @contextmanager
+    def timer(self, name, sample_every=1):
+        """Times the with block under name.
+        Usage:
+        with profiler.timer('load_data'):
+            pass
+        """
+        if not self.enabled or (sample_every > 1 and not self.should_sample(name, sample_every)):
+            yield
+            return
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter_ns() - start, counted=sample_every > 1)
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+    def stats(self):
+        """Summary per name in seconds. With sampling, total_sec is extrapolated from the sampled calls."""
+        with self._lock:
+            items = [(name, stat) for name, stat in self._stats.items() if stat.samples]
+            return {name: {'calls': stat.calls,
+                           'samples': stat.samples,
+                           'total_sec': stat.total_ns * stat.calls / stat.samples / 1e9,
+                           'mean_sec': stat.total_ns / stat.samples / 1e9,
+                           'min_sec': stat.min_ns / 1e9,
+                           'max_sec': stat.max_ns / 1e9,
+                           'p50_sec': stat.percentile(50) / 1e9,
+                           'p90_sec': stat.percentile(90) / 1e9,
+                           'p99_sec': stat.percentile(99) / 1e9}
+                    for name, stat in items}
+
+    def to_json(self, file=None):
+        """Stats as a JSON string, also saved to file if given."""
+        stats = self.stats()
+        if file:
+            save_json(stats, file)
+        return json.dumps(stats, indent=4)
+
+    def log_line(self, top=None):
+        """Single line summary, names sorted by total time."""
+        stats = sorted(self.stats().items(), key=lambda item: item[1]['total_sec'], reverse=True)[:top]
+        return 'profile: ' + '; '.join(
+            '%s calls=%d total=%.3fs mean=%.3fms p99=%.3fms' % (
+                name, s['calls'], s['total_sec'], s['mean_sec'] * 1e3, s['p99_sec'] * 1e3)
+            for name, s in stats)
+
+    def to_prometheus(self, metric='psy_function_duration_seconds'):
+        """Prometheus text exposition of the histograms, plus a counter of all (also unsampled) calls."""
+        with self._lock:
+            items = sorted((name, stat.calls, stat.samples, stat.total_ns, list(stat.buckets))
+                           for name, stat in self._stats.items())
+        lines = ['# HELP %s Duration of profiled functions.' % metric, '# TYPE %s histogram' % metric]
+        for name, _, samples, total_ns, buckets in items:
+            label = name.replace('\\', '\\\\').replace('"', '\\"')
+            used = [b for b, count in enumerate(buckets) if count]
+            cumulative = 0
+            for b in range(used[0] if used else 0, used[-1] + 1 if used else 0):
+                cumulative += buckets[b]
+                lines.append('%s_bucket{name="%s",le="%.9g"} %d' % (metric, label, 2 ** b / 1e9, cumulative))
+            lines.append('%s_bucket{name="%s",le="+Inf"} %d' % (metric, label, samples))
+            lines.append('%s_sum{name="%s"} %.9g' % (metric, label, total_ns / 1e9))
+            lines.append('%s_count{name="%s"} %d' % (metric, label, samples))
+        lines += ['# HELP psy_function_calls_total Calls of profiled functions, including unsampled ones.',
+                  '# TYPE psy_function_calls_total counter']
+        lines += ['psy_function_calls_total{name="%s"} %d' % (name.replace('\\', '\\\\').replace('"', '\\"'), calls)
+                  for name, calls, _, _, _ in items]
+        return '\n'.join(lines) + '\n'
+
+
+profiler = Profiler(enabled=os.environ.get('PSY_PROFILE', '1') != '0')
+
+
+def _profiled(f, name, sample_every, after=None):
+    name = name or '%s.%s' % (f.__module__, f.__qualname__)
+
     @wraps(f)
     def wrapper(*args, **kwargs):
-        start = time.time()
+        if not profiler.enabled:
+            return f(*args, **kwargs)
+        if sample_every > 1 and not profiler.should_sample(name, sample_every):
+            return f(*args, **kwargs)
+        start = time.perf_counter_ns()
         result = f(*args, **kwargs)
-        end = time.time()
-        print('function:%r took: %2.2f sec' % (f.__name__,  end - start))
+        duration_ns = time.perf_counter_ns() - start
+        profiler.record(name, duration_ns, counted=sample_every > 1)
+        if after:
+            after(name, duration_ns)
         return result
     return wrapper
 
 
-def track_start_end(f):
-    """Decorator for printing start and end of function
+def timing(f=None, name=None, sample_every=1, verbose=True):
+    """Decorator for timing functions, recorded in profiler under name (module.qualname of the function by default)
+    sample_every: time one in every sample_every calls, for very hot functions
+    verbose: print the time of every call
+    Usage:
+    @timing
+    def function(a):
+        pass
+
+    @timing(verbose=False, sample_every=100)
+    def hot_function(a):
+        pass
+    """
+    if f is None:
+        return lambda f: timing(f, name=name, sample_every=sample_every, verbose=verbose)
+    after = (lambda _, duration_ns: print('function:%r took: %2.2f sec' % (f.__name__, duration_ns / 1e9))) \
+        if verbose else None
+    return _profiled(f, name, sample_every, after=after)
+
+
+def track_start_end(f=None, name=None, verbose=True):
+    """Decorator for printing start and end of function, also recorded in profiler
     Usage:
     @track_start_end
     def function(a):
         pass
     """
+    if f is None:
+        return lambda f: track_start_end(f, name=name, verbose=verbose)
+    if not verbose:
+        return _profiled(f, name, 1)
 
     @wraps(f)
     def wrapper(*args, **kwargs):
-        print('Started:%r' % (f.__name__))
-        result = f(*args, **kwargs)
-        print('Ended:%r' % (f.__name__))
+        print('Started:%r' % (name or f.__name__))
+        result = profiled(*args, **kwargs)
+        print('Ended:%r' % (name or f.__name__))
         return result
+    profiled = _profiled(f, name, 1)
     return wrapper
 
 
+def profile_block(name, sample_every=1):
+    """Context manager timing a block into profiler
+    Usage:
+    with profile_block('parse'):
+        pass
+    """
+    return profiler.timer(name, sample_every=sample_every)
+
+
 def get_dict_by_list_of_keys(dictionary, keys):
     if type(keys) == type([]):
         for key in keys:
@@ -131,12 +421,96 @@ def add_params_to_object_from_dict_path(object, dictionary_path, key=None):
     return add_params_to_object_from_dict(object, dictionary, key=key)
 
         
-def call(method, url, payload=None, headers={'Content-Type': 'application/json'}):
-    """ Use for calling APIs.
+HTTP_TIMEOUT = (3.05, 60)  # (connect, read) seconds
+HTTP_RETRIES = 3
+HTTP_BACKOFF_FACTOR = 0.5
+HTTP_POOL_SIZE = 32
+HTTP_RETRY_STATUSES = (429, 502, 503, 504)
+
+_http_session = None
+_http_session_lock = threading.Lock()
+_http_config = {'timeout': HTTP_TIMEOUT, 'retries': HTTP_RETRIES, 'backoff_factor': HTTP_BACKOFF_FACTOR,
+                'pool_size': HTTP_POOL_SIZE, 'retry_methods': None}
+
+
+def set_http_config(timeout=HTTP_TIMEOUT, retries=HTTP_RETRIES, backoff_factor=HTTP_BACKOFF_FACTOR,
+                    pool_size=HTTP_POOL_SIZE, retry_methods=None):
+    """Configures the session shared by call and call_many
+    timeout: seconds, or a (connect, read) tuple
+    retries: retries on connection errors and 429/502/503/504, sleeping backoff_factor * 2 ** (retry - 1) in between
+    pool_size: keep-alive connections kept per host, should be at least the n_jobs of call_many
+    retry_methods: methods retried on those statuses, urllib3's idempotent methods by default.
+        Pass ex. ['POST'] for model services whose POST requests are safe to repeat.
+    """
+    global _http_session
+    with _http_session_lock:
+        _http_config.update(timeout=timeout, retries=retries, backoff_factor=backoff_factor, pool_size=pool_size,
+                            retry_methods=retry_methods)
+        old_session, _http_session = _http_session, None
+    if old_session is not None:
+        old_session.close()
+
+
+def get_http_session():
+    """Process-wide requests.Session with per-host keep-alive connection pools and retries."""
+    global _http_session
+    if _http_session is None:
+        with _http_session_lock:
+            if _http_session is None:
+                retry_kwargs = {}
+                if _http_config['retry_methods'] is not None:
+                    retry_kwargs['allowed_methods'] = frozenset(m.upper() for m in _http_config['retry_methods'])
+                retry = Retry(total=_http_config['retries'], backoff_factor=_http_config['backoff_factor'],
+                              status_forcelist=HTTP_RETRY_STATUSES, raise_on_status=False, **retry_kwargs)
+                adapter = HTTPAdapter(pool_connections=_http_config['pool_size'],
+                                      pool_maxsize=_http_config['pool_size'], max_retries=retry)
+                session = requests.Session()
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                _http_session = session
+    return _http_session
+
+
+def _reset_http_session():
+    global _http_session, _http_session_lock
+    _http_session = None  # Sockets are shared with the parent, so the child opens its own
+    _http_session_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_http_session)
+
+
+def call(method, url, payload=None, headers={'Content-Type': 'application/json'}, timeout=None):
+    """ Use for calling APIs. Connections are kept alive and reused, see set_http_config for timeouts and retries.
+    payload: JSON encoded if not None
     Usage
     call('delete', 'http://localhost:8888/delete')
+    call('post', 'http://localhost:8888/predict', {'text': 'abc'}, timeout=5)
     """
-    return getattr(getattr(requests, method)(url, data=json.dumps(payload), headers=headers), 'json')()
+    data = None if payload is None else _dumps_json_compact(payload)
+    response = get_http_session().request(method.upper(), url, data=data, headers=headers,
+                                          timeout=_http_config['timeout'] if timeout is None else timeout)
+    return response.json()
+
+
+def call_many(calls, n_jobs=16, return_exceptions=False):
+    """Runs calls concurrently on at most n_jobs threads, results in the order of calls
+    calls: (method, url) or (method, url, payload) tuples, or dicts of call's keyword arguments
+    return_exceptions: put the exception of a failed call in its place instead of raising it
+    Usage
+    call_many([('post', 'http://localhost:8888/predict', {'text': text}) for text in texts], n_jobs=32)
+    """
+    def run(args):
+        try:
+            return call(**args) if isinstance(args, dict) else call(*args)
+        except Exception as e:
+            if return_exceptions:
+                return e
+            raise
+    calls = list(calls)
+    with ThreadPoolExecutor(max_workers=max(1, min(n_jobs, len(calls)))) as executor:
+        return list(executor.map(run, calls))
 
 
 def get_cpu_count():
@@ -144,22 +518,167 @@ def get_cpu_count():
     return multiprocessing.cpu_count()
 
 
+def _loads_json(data):
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass  # ex. NaN written by the stdlib json, which orjson rejects
+    return json.loads(data)
+
+
+def _dumps_json_compact(json_data):
+    if orjson is not None:
+        try:
+            return orjson.dumps(json_data, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+        except TypeError:
+            pass  # Types orjson can't serialize
+    return json.dumps(json_data, separators=(',', ':')).encode('utf-8')
+
+
 def load_json(file):
-    with open(file) as json_file:
-        return json.load(json_file)
+    """Uses orjson if installed, else the stdlib json."""
+    with open(file, 'rb') as json_file:
+        return _loads_json(json_file.read())
+
+
+def save_json(json_data, file, indent=4, compact=False):
+    """compact: No indentation or spaces, written with orjson if installed.
+    orjson writes NaN and Infinity as null, the stdlib json writes them as NaN and Infinity.
+    """
+    if compact:
+        with open(file, 'wb') as outfile:
+            outfile.write(_dumps_json_compact(json_data))
+    else:
+        with open(file, 'w') as outfile:
+            json.dump(json_data, outfile, indent=indent)
+
+
+def iter_jsonl(file):
+    """Generator of records of a JSON Lines file, one line in memory at a time."""
+    with open(file, 'rb') as jsonl_file:
+        for line in jsonl_file:
+            if line.strip():
+                yield _loads_json(line)
 
 
-def save_json(json_data, file, indent=4):
-    with open(file, 'w') as outfile:
-        json.dump(json_data, outfile, indent=indent)
+def save_jsonl(records, file, append=False):
+    """Writes an iterable of records to a JSON Lines file one at a time. Returns the number of records written."""
+    count = 0
+    with open(file, 'ab' if append else 'wb') as outfile:
+        for record in records:
+            outfile.write(_dumps_json_compact(record))
+            outfile.write(b'\n')
+            count += 1
+    return count
+
+
+@contextmanager
+def atomic_write(path, mode='wb', **kwargs):
+    """Opens a temp file next to path which replaces path only once the block finishes without error.
+    Readers never see a half written file.
+    Usage:
+    with atomic_write('model.pkl') as f:
+        f.write(data)
+    """
+    tmp_path = '%s.%d.%d.tmp' % (path, os.getpid(), threading.get_ident())
+    try:
+        with open(tmp_path, mode, **kwargs) as f:
+            yield f
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
 
 
 def save_pickle(object, path):
-    pickle.dump(object, open(path, 'wb'), protocol=pickle.HIGHEST_PROTOCOL)
+    with atomic_write(path) as f:
+        pickle.dump(object, f, protocol=pickle.HIGHEST_PROTOCOL)
 
 
 def load_pickle(path):
-    return pickle.load(open(path, 'rb'))
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+COMPRESSORS = {'gzip': gzip, 'bz2': bz2, 'lzma': lzma}
+BUFFER_ALIGNMENT = 64
+
+
+def save_pickle_oob(object, path, compress=None):
+    """Pickles with protocol 5, writing large buffers (NumPy arrays, pandas columns) out-of-band to a sidecar file
+    path + '.<token>.buffers'. Buffers are written straight from the object's memory instead of being copied into
+    one pickle stream. Every save writes a new sidecar named in the header at path, and the header is replaced last,
+    so a reader always sees a header and the buffers saved with it.
+    compress: None, 'gzip', 'bz2' or 'lzma'. Compressed buffers can't be memory mapped on load.
+    """
+    if compress is not None and compress not in COMPRESSORS:
+        raise ValueError('compress must be one of %s' % sorted(COMPRESSORS))
+    buffers = []
+
+    def buffer_callback(buffer):
+        try:
+            buffers.append(buffer.raw())
+        except BufferError:
+            return True  # Non-contiguous buffers are kept in-band
+        return False
+
+    payload = pickle.dumps(object, protocol=5, buffer_callback=buffer_callback)
+    index = []
+    buffers_file = '%s.%s.buffers' % (os.path.basename(path), uuid.uuid4().hex)
+    with atomic_write(os.path.join(os.path.dirname(path), buffers_file)) as f:
+        for buffer in buffers:
+            if compress is not None:
+                buffer = COMPRESSORS[compress].compress(buffer)
+            f.write(b'\0' * (-f.tell() % BUFFER_ALIGNMENT))
+            index.append((f.tell(), buffer.nbytes if isinstance(buffer, memoryview) else len(buffer)))
+            f.write(buffer)
+    if compress is not None:
+        payload = COMPRESSORS[compress].compress(payload)
+    old_buffers_path = _get_oob_buffers_path(path) if os.path.exists(path) else None
+    with atomic_write(path) as f:
+        pickle.dump({'format': 'psy-oob-1', 'compress': compress, 'buffers': index, 'payload': payload,
+                     'buffers_file': buffers_file}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    if old_buffers_path is not None and os.path.exists(old_buffers_path):
+        os.remove(old_buffers_path)  # Readers that already opened it keep reading it
+
+
+def _read_oob_header(path):
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def _get_oob_buffers_path(path, header=None):
+    header = _read_oob_header(path) if header is None else header
+    return os.path.join(os.path.dirname(path), header.get('buffers_file', os.path.basename(path) + '.buffers'))
+
+
+def load_pickle_oob(path, mmap_mode=True):
+    """Loads a save_pickle_oob file.
+    mmap_mode: Maps uncompressed buffers read-only instead of reading them, so NumPy arrays are read-only views
+    whose pages are loaded lazily and shared between processes loading the same file.
+    """
+    for attempt in range(3):
+        header = _read_oob_header(path)
+        try:
+            f = open(_get_oob_buffers_path(path, header), 'rb')
+            break
+        except FileNotFoundError:
+            if attempt == 2:
+                raise  # Else the file was saved again since the header was read
+    compress = header['compress']
+    payload = header['payload'] if compress is None else COMPRESSORS[compress].decompress(header['payload'])
+    buffers = []
+    with f:
+        if mmap_mode and compress is None and sum(nbytes for _, nbytes in header['buffers']):
+            view = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+            buffers = [view[offset:offset + nbytes] for offset, nbytes in header['buffers']]
+        else:
+            for offset, nbytes in header['buffers']:
+                f.seek(offset)
+                buffer = f.read(nbytes)
+                buffers.append(bytearray(buffer if compress is None else COMPRESSORS[compress].decompress(buffer)))
+    return pickle.loads(payload, buffers=buffers)
 
 
 def get_datetime(zone='UTC', format='%Y-%m-%d-%H:%M:%S'):
@@ -186,10 +705,154 @@ def get_timestamp(zone='UTC'):
     return time.strftime('%Y-%m-%d %H:%M:%S')
 
 
+_NUMBER = r'(-?\d+(?:\.\d*)?(?:[eE][-+]?\d+)?)'
+
+
+def _checkpoint_value(file_name, key):
+    """Number following key in a file name like model-epoch-12-val_loss-0.2345.h5, None if missing.
+    key has to start the name or follow a '-' or '.', so 'loss' does not match the loss in val_loss:
+    _checkpoint_value('model-epoch-3-val_loss-0.7000-loss-0.5000', 'loss') == 0.5
+    """
+    match = re.search(r'(?<![A-Za-z0-9_])%s[-_=]%s' % (re.escape(key), _NUMBER), file_name)
+    if match is None:
+        return None
+    value = match.group(1).rstrip('.')
+    return int(value) if value.lstrip('-').isdigit() else float(value)
+
+
 def get_epoch_num(file_path):
     """For keras saved model with file_name format"""
-    x = file_path.split('-')
-    return int(x[x.index('epoch') + 1].replace('.h5', ''))
+    return int(_checkpoint_value(os.path.basename(file_path), 'epoch'))
+
+
+class CheckpointIndex(object):
+    """Index of the checkpoints in a directory by epoch and metric, parsed from file names like
+    model-epoch-12-val_loss-0.2345.h5
+
+    Names are parsed once. refresh only rescans when the directory's mtime changed, so best and latest are O(1)
+    between saves. Checkpoints written by this process can also be registered directly with add.
+    metric: name of the metric in the file names, ex. 'val_loss'
+    mode: 'min' if lower metric values are better, else 'max'
+    Usage:
+    index = CheckpointIndex('models', metric='val_loss')
+    model.load_weights(index.best())
+    index.prune(keep=3)
+    """
+
+    def __init__(self, directory, extension='h5', metric=None, mode='min', epoch_key='epoch'):
+        assert mode in ('min', 'max'), "mode should be 'min' or 'max'"
+        self.directory = directory
+        self.extension = extension
+        self.metric = metric
+        self.mode = mode
+        self.epoch_key = epoch_key
+        self._entries = {}  # path: (epoch, metric value)
+        self._best = self._latest = None
+        self._stale = False  # best/latest need a recompute after a removal
+        self._dir_mtime = None
+        self.refresh()
+
+    def _parse(self, path):
+        name = os.path.basename(path)[:-len(self.extension) - 1]
+        return (_checkpoint_value(name, self.epoch_key),
+                _checkpoint_value(name, self.metric) if self.metric else None)
+
+    def _latest_key(self, path):
+        epoch = self._entries[path][0]
+        return (epoch is not None, epoch or 0, path)
+
+    def _best_key(self, path):
+        value = self._entries[path][1]
+        if value is None or value != value:  # Checkpoints without a metric, or with NaN, rank last
+            return (False, 0, self._latest_key(path))
+        return (True, -value if self.mode == 'min' else value, self._latest_key(path))
+
+    def add(self, path):
+        """Registers a checkpoint file, ex. right after saving it."""
+        self._entries[path] = self._parse(path)
+        if not self._stale:
+            if self._latest is None or self._latest_key(path) > self._latest_key(self._latest):
+                self._latest = path
+            if self._best is None or self._best_key(path) > self._best_key(self._best):
+                self._best = path
+        return self._entries[path]
+
+    def remove(self, path):
+        if self._entries.pop(path, None) is not None and path in (self._best, self._latest):
+            self._stale = True
+
+    def refresh(self, force=False):
+        """Picks up added and deleted files if the directory changed since the last scan."""
+        try:
+            dir_mtime = os.stat(self.directory).st_mtime_ns
+        except FileNotFoundError:
+            dir_mtime = None
+        if dir_mtime == self._dir_mtime and not force:
+            return
+        self._dir_mtime = dir_mtime
+        suffix = '.' + self.extension
+        paths = set()
+        if dir_mtime is not None:
+            with os.scandir(self.directory) as it:
+                paths = {entry.path for entry in it if entry.name.endswith(suffix) and entry.is_file()}
+        for path in set(self._entries) - paths:
+            self.remove(path)
+        for path in paths - set(self._entries):
+            self.add(path)
+
+    def _update(self):
+        self.refresh()
+        if self._stale:
+            self._best = max(self._entries, key=self._best_key, default=None)
+            self._latest = max(self._entries, key=self._latest_key, default=None)
+            self._stale = False
+
+    def best(self):
+        """Path of the checkpoint with the best metric, ties and missing metrics going to the latest epoch."""
+        self._update()
+        return self._best
+
+    def latest(self):
+        """Path of the checkpoint with the highest epoch."""
+        self._update()
+        return self._latest
+
+    def ranked(self):
+        """Paths from best to worst."""
+        self._update()
+        return sorted(self._entries, key=self._best_key, reverse=True)
+
+    def epochs(self):
+        """{path: (epoch, metric value)}"""
+        self._update()
+        return dict(self._entries)
+
+    def prune(self, keep=1, keep_latest=True, dry_run=False):
+        """Deletes all but the top keep checkpoints by metric, and the latest one if keep_latest to allow resuming.
+        Returns the paths deleted (or that would be with dry_run)."""
+        ranked = self.ranked()
+        kept = set(ranked[:keep])
+        if keep_latest and self._latest is not None:
+            kept.add(self._latest)
+        deleted = [path for path in ranked if path not in kept]
+        if not dry_run:
+            for path in deleted:
+                print('Deleting %s' % path)
+                os.remove(path)
+                self.remove(path)
+            self._dir_mtime = os.stat(self.directory).st_mtime_ns if deleted else self._dir_mtime
+        return deleted
+
+
+_checkpoint_indexes = {}
+
+
+def get_checkpoint_index(directory, extension='h5', metric=None, mode='min'):
+    """CheckpointIndex shared across calls for the same directory and settings."""
+    key = (os.path.abspath(directory), extension, metric, mode)
+    if key not in _checkpoint_indexes:
+        _checkpoint_indexes[key] = CheckpointIndex(directory, extension=extension, metric=metric, mode=mode)
+    return _checkpoint_indexes[key]
 
 
 def get_all_filepaths_with_extension(directory, extension='h5'):
@@ -198,15 +861,17 @@ def get_all_filepaths_with_extension(directory, extension='h5'):
 
 
 def delete_files_with_extension(directory, extension='h5'):
-    for p in get_all_filepaths_with_extension(directory, extension='h5'):
+    for p in get_all_filepaths_with_extension(directory, extension=extension):
         print('Deleting %s' % p)
         os.remove(p)
 
 
-def get_best_model_path(directory, extension='h5'):
-    """For keras saved model with file_name format"""
-    return sorted(get_all_filepaths_with_extension(directory, extension='h5'), reverse=True)[0]
-
+def get_best_model_path(directory, extension='h5', metric=None, mode='min'):
+    """For keras saved model with file_name format
+    Latest epoch, or the best value of metric if given. None if there are no checkpoints.
+    """
+    index = get_checkpoint_index(directory, extension=extension, metric=metric, mode=mode)
+    return index.best() if metric else index.latest()
 
 
 def get_environment(env_variable='api_environment'):
@@ -43,6 +43,7 @@ setup(
     keywords=['SOME', 'MEANINGFULL', 'KEYWORDS'],
     packages=find_packages(exclude=('tests', 'bin')),
     test_suite='tests',
+    python_requires='>=3.8',
     install_requires=required,
     include_package_data=True,  # all files and directories listed in MANIFEST.in.
     zip_safe=False,  # the package can run out of an .egg file
@@ -0,0 +1,137 @@
+import random
+import unittest
+
+import pandas as pd
+
+from psy.utilities import text_preprocessors as tp
+
+WORDS = ['Revenue', 'operations', 'total', 'income', 'of', 'the', 'at', 'January', 'march', 'SEP', 'december',
+         'ii', 'IV', 'xii', 'mix', 'civil', 'vivid', 'Mixed', 'café', 'Straße', 'Ærø', 'naïve', '中文', 'ёж']
+MARKS = ['(a)', '(ii)', '{b}', '[x]', '(1)', '1.', '12,345', '3.5', '-', '\n', '()', 'x2', '2019', 'abc123def']
+
+
+def make_corpus(n_strings, seed=0):
+    """Seeded mix of words, months, roman numerals, brackets, digits, newlines and non-ASCII text."""
+    rng = random.Random(seed)
+    corpus = ['', ' ', 'I', 'ii iii', 'Jan Feb', '(a)', '\n\n']
+    for _ in range(n_strings - len(corpus)):
+        tokens = [rng.choice(WORDS) if rng.random() < 0.7 else rng.choice(MARKS) for _ in range(rng.randint(1, 12))]
+        corpus.append(rng.choice([' ', '', '\n']).join(tokens))
+    return corpus
+
+
+class TestTextCleanerBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.corpus = make_corpus(2000)
+        self.expected = [tp.text_cleaner(x) for x in self.corpus]
+
+    def test_list_input(self):
+        self.assertEqual(tp.text_cleaner_batch(self.corpus), self.expected)
+
+    def test_chained_method(self):
+        self.assertEqual(tp.text_cleaner_batch(self.corpus, method='chained'), self.expected)
+
+    def test_series_input_keeps_index(self):
+        index = pd.Index(range(len(self.corpus), 0, -1)) * 3
+        result = tp.text_cleaner_batch(pd.Series(self.corpus, index=index))
+        self.assertIsInstance(result, pd.Series)
+        self.assertTrue(result.index.equals(index))
+        self.assertEqual(result.tolist(), self.expected)
+
+
+
+def make_random_corpus(n_strings, seed=0):
+    """Seeded strings of random ASCII, Latin, Greek, Cyrillic and CJK characters mixed with corpus tokens."""
+    rng = random.Random(seed)
+    alphabet = [chr(c) for c in list(range(32, 127)) + list(range(0xa0, 0x250)) + list(range(0x370, 0x450))
+                + list(range(0x4e00, 0x4e40))] + ['\n', '\t']
+    corpus = []
+    for _ in range(n_strings):
+        pieces = []
+        for _ in range(rng.randint(0, 10)):
+            if rng.random() < 0.5:
+                pieces.append(rng.choice(WORDS + MARKS))
+            else:
+                pieces.append(''.join(rng.choice(alphabet) for _ in range(rng.randint(1, 8))))
+        corpus.append(rng.choice([' ', '', '\n']).join(pieces))
+    return corpus
+
+
+class TestFusedTextCleaner(unittest.TestCase):
+    """The fused text_cleaner has to give exactly the chained output. Catches edits to MONTHS, ROMAN_NUMBERS_RE,
+    ROMAN_WORD_RE or the other patterns that make the two diverge."""
+
+    def setUp(self):
+        self.corpus = make_corpus(5000, seed=1) + make_random_corpus(20000, seed=2)
+
+    def test_text_cleaner(self):
+        mismatches = [x for x in self.corpus if tp.text_cleaner(x, method='fused') != tp.text_cleaner(x)]
+        self.assertEqual(mismatches, [])
+
+    def test_text_cleaner_batch(self):
+        self.assertEqual(tp.text_cleaner_batch(self.corpus, method='fused'),
+                         tp.text_cleaner_batch(self.corpus, method='chained'))
+
+    def test_months_and_romans(self):
+        for month in tp.MONTHS:
+            for text in [month, month.upper(), month.capitalize(), 'in %s 2019' % month, '%s(iv)' % month]:
+                self.assertEqual(tp.text_cleaner(text, method='fused'), tp.text_cleaner(text), text)
+        for roman in ['i', 'ii', 'iv', 'ix', 'xii', 'xiv', 'civ', 'mmxix', 'vivid', 'mix', 'IV', 'Xii']:
+            for text in [roman, 'total %s net' % roman, '(%s) total' % roman]:
+                self.assertEqual(tp.text_cleaner(text, method='fused'), tp.text_cleaner(text), text)
+
+
+
+class TestProcessParenthesis(unittest.TestCase):
+
+    def test_markers_removed(self):
+        self.assertEqual(tp.process_parenthesis('Revenue (a) net'), 'Revenue  net')
+        self.assertEqual(tp.process_parenthesis('Note (1) and (2) end'), 'Note  and  end')
+        self.assertEqual(tp.process_parenthesis('(b) Revenue '), 'Revenue')
+
+    def test_long_contents_kept(self):
+        self.assertEqual(tp.process_parenthesis('(ii) kept'), '(ii) kept')
+        self.assertEqual(tp.process_parenthesis('a (b (c) d) e'), 'a (b (c) d) e')
+
+    def test_passthrough_without_both_parenthesis(self):
+        for text in [' no parens ', ' x (y ', ' x) y ', '']:
+            self.assertEqual(tp.process_parenthesis(text), text)
+
+    def test_documented_behaviour_changes(self):
+        self.assertEqual(tp.process_parenthesis('Data (a) x'), 'Data  x')
+        self.assertEqual(tp.process_parenthesis('()'), '')
+        self.assertEqual(tp.process_parenthesis('Total () net'), 'Total  net')
+
+    def test_batch(self):
+        texts = ['Revenue (a) net', '(ii) kept', ' no parens ', 'Data (a) x', '()']
+        expected = [tp.process_parenthesis(x) for x in texts]
+        self.assertEqual(tp.process_parenthesis_batch(texts), expected)
+        series = pd.Series(texts, index=[5, 4, 3, 2, 1])
+        result = tp.process_parenthesis_batch(series)
+        self.assertEqual(result.tolist(), expected)
+        self.assertTrue(result.index.equals(series.index))
+
+
+
+class TestTextPipelineSteps(unittest.TestCase):
+
+    def test_module_preprocessors(self):
+        pipeline = tp.TextPipeline(['unicode_to_ASCII', tp.remove_numbers, ('truncate_text', {'max_len': 5}), 'lower_text'])
+        self.assertEqual(pipeline('H\u00e9llo 123 World'), 'hello')
+        self.assertEqual(tp.TextPipeline.from_dict(pipeline.to_dict()).steps, pipeline.steps)
+
+    def test_rejects_other_functions(self):
+
+        def remove_numbers(x):
+            return x
+
+        for step in [tp.unidecode, 'unidecode', remove_numbers, str.lower, lambda x: x, tp.clean_texts_parallel,
+                     'get_html_parser', 'text_cleaner_batch', tp.process_parenthesis_batch, '_text_cleaner_fused',
+                     'helpers', 3]:
+            with self.assertRaises(ValueError):
+                tp.TextPipeline([step])
+
+
+if __name__ == '__main__':
+    unittest.main()